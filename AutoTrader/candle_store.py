@@ -0,0 +1,193 @@
+"""
+Database layout shared by the downloader, the live updater and the API server:
+the candle tables, the symbols table and the compressed candle archive.
+"""
+import zlib
+from itertools import groupby
+
+import numpy as np
+
+# Archived candles are grouped into one block per day
+SECONDS_PER_DAY = 86400
+
+# Columns of an archived candle block, stored one after another in its payload
+COLD_COLUMNS = ('time', 'open', 'high', 'low', 'close', 'tick_volume', 'spread', 'real_volume')
+
+def create_store_tables(cursor, symbol_digits):
+    """
+    Create the symbols and candles_cold tables if they don't exist, and record
+    the price digits of new symbols.
+    
+    :param cursor: SQLite cursor object
+    :param symbol_digits: Dictionary mapping each symbol to its number of price digits
+    :return: Dictionary mapping each stored symbol to the digits its prices are scaled by
+    """
+    # Prices are stored as integers scaled by 10**digits. Keep the digits a
+    # symbol was first stored with so existing candles stay consistent.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS symbols (
+        symbol TEXT PRIMARY KEY,
+        digits INTEGER NOT NULL
+    )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO symbols (symbol, digits) VALUES (?, ?)', symbol_digits.items())
+    cursor.execute('SELECT symbol, digits FROM symbols')
+    stored_digits = dict(cursor.fetchall())
+    
+    # Archived candles, one compressed block per symbol, timeframe and day
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS candles_cold (
+        symbol TEXT NOT NULL,
+        timeframe TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        first_time INTEGER NOT NULL,
+        last_time INTEGER NOT NULL,
+        candles INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        PRIMARY KEY (symbol, timeframe, day)
+    ) WITHOUT ROWID
+    ''')
+    
+    return stored_digits
+
+def create_candle_table(cursor, table_name, digits):
+    """
+    Create the candle table for a symbol and timeframe if it doesn't exist,
+    converting tables created by older versions to the current layout.
+    
+    :param cursor: SQLite cursor object
+    :param table_name: Table name in the form SYMBOL_TIMEFRAME
+    :param digits: Number of price digits the prices are scaled by
+    :return: True if an older table was converted, False otherwise
+    """
+    cursor.execute(f'PRAGMA table_info("{table_name}")')
+    column_types = {row[1]: row[2].upper() for row in cursor.fetchall()}
+    
+    # Older versions keyed candles by an id and a unique datetime string, and
+    # stored REAL prices
+    legacy = 'datetime' in column_types or column_types.get('open') == 'REAL'
+    legacy_table = f"{table_name}_legacy" if legacy else None
+    if legacy_table:
+        cursor.execute(f'ALTER TABLE "{table_name}" RENAME TO "{legacy_table}"')
+    
+    # time is the primary key (stored as the rowid), so candles are kept in
+    # time order in a single B-tree; the datetime string is derived from it
+    # when reading. Integer prices take 3-4 bytes per value instead of 8.
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS "{table_name}" (
+        time INTEGER PRIMARY KEY,
+        open INTEGER,
+        high INTEGER,
+        low INTEGER,
+        close INTEGER,
+        tick_volume INTEGER,
+        spread INTEGER,
+        real_volume INTEGER,
+        is_completed INTEGER DEFAULT 1
+    )
+    ''')
+    
+    if legacy_table:
+        scale = 10 ** digits
+        is_completed = 'COALESCE(is_completed, 1)' if 'is_completed' in column_types else '1'
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO "{table_name}" (time, open, high, low, close, tick_volume, spread, real_volume, is_completed)
+        SELECT
+            time,
+            CAST(ROUND(open * {scale}) AS INTEGER),
+            CAST(ROUND(high * {scale}) AS INTEGER),
+            CAST(ROUND(low * {scale}) AS INTEGER),
+            CAST(ROUND(close * {scale}) AS INTEGER),
+            tick_volume,
+            COALESCE(spread, 0),
+            COALESCE(real_volume, 0),
+            {is_completed}
+        FROM "{legacy_table}"
+        ''')
+        cursor.execute(f'DROP TABLE "{legacy_table}"')
+    
+    return legacy_table is not None
+
+def encode_candle_block(rows):
+    """
+    Compress candles into a single blob. The columns are stored one after
+    another as little-endian int64: times as delta-of-deltas (0 for evenly
+    spaced candles) and prices as differences from the previous candle, so
+    zlib mostly sees small, repeating values.
+    
+    :param rows: List of (time, open, high, low, close, tick_volume, spread, real_volume) tuples in time order
+    :return: Compressed payload bytes
+    """
+    columns = np.array(rows, dtype=np.int64).T.copy()
+    columns[0] = np.diff(np.diff(columns[0], prepend=0), prepend=0)
+    columns[1:5] = np.diff(columns[1:5], axis=1, prepend=0)
+    return zlib.compress(columns.astype('<i8').tobytes(), 9)
+
+def decode_candle_block(payload):
+    """
+    Decompress a block of archived candles written by encode_candle_block
+    
+    :param payload: Compressed block from the candles_cold table
+    :return: int64 array with one row per column of COLD_COLUMNS, oldest candle first
+    """
+    columns = np.frombuffer(zlib.decompress(payload), dtype='<i8').reshape(len(COLD_COLUMNS), -1)
+    times = np.cumsum(np.cumsum(columns[0]))
+    prices = np.cumsum(columns[1:5], axis=1)
+    return np.vstack((times, prices, columns[5:]))
+
+def get_cold_watermark(cursor, symbol, timeframe_str):
+    """
+    Get the time below which the candles of a symbol and timeframe are archived.
+    
+    :param cursor: SQLite cursor object
+    :param symbol: Trading symbol
+    :param timeframe_str: String representation of timeframe (M1, H1, etc.)
+    :return: Unix timestamp of the end of the last archived day, or 0 if nothing is archived
+    """
+    cursor.execute('SELECT MAX(day) FROM candles_cold WHERE symbol = ? AND timeframe = ?', (symbol, timeframe_str))
+    last_day = cursor.fetchone()[0]
+    return 0 if last_day is None else last_day + SECONDS_PER_DAY
+
+def archive_cold_candles(cursor, symbol, timeframe_str, cutoff):
+    """
+    Move the candles older than the cutoff into compressed daily blocks. Days
+    from the first one holding an incomplete candle on are kept in the table,
+    so that candle can still be corrected. Runs inside the caller's
+    transaction; database errors are raised to the caller.
+    
+    :param cursor: SQLite cursor object
+    :param symbol: Trading symbol
+    :param timeframe_str: String representation of timeframe (M1, H1, etc.)
+    :param cutoff: Unix timestamp at the start of a day; older candles are archived
+    :return: Number of candles archived
+    """
+    table_name = f"{symbol}_{timeframe_str}"
+    
+    # Stop at the day of the first incomplete candle
+    cursor.execute(f'SELECT MIN(time) FROM "{table_name}" WHERE time < ? AND is_completed = 0', (cutoff,))
+    first_incomplete = cursor.fetchone()[0]
+    if first_incomplete is not None:
+        cutoff = first_incomplete - first_incomplete % SECONDS_PER_DAY
+    
+    # Days already archived are complete, so candles in them are only duplicates
+    watermark = get_cold_watermark(cursor, symbol, timeframe_str)
+    cursor.execute(f'''
+    SELECT time, open, high, low, close, tick_volume, spread, real_volume
+    FROM "{table_name}" WHERE time >= ? AND time < ? ORDER BY time
+    ''', (watermark, cutoff))
+    
+    blocks = []
+    for day, day_rows in groupby(cursor.fetchall(), key=lambda row: row[0] - row[0] % SECONDS_PER_DAY):
+        day_rows = list(day_rows)
+        blocks.append((
+            symbol, timeframe_str, day, day_rows[0][0], day_rows[-1][0], len(day_rows),
+            encode_candle_block(day_rows)
+        ))
+    
+    cursor.executemany('''
+    INSERT INTO candles_cold (symbol, timeframe, day, first_time, last_time, candles, payload)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', blocks)
+    cursor.execute(f'DELETE FROM "{table_name}" WHERE time < ?', (cutoff,))
+    
+    return sum(block[5] for block in blocks)
@@ -2,11 +2,47 @@ import time
 import json
 import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import MetaTrader5 as mt5
-import pandas as pd
 import numpy as np
 import pytz
+from candle_store import (
+    SECONDS_PER_DAY, archive_cold_candles, create_candle_table, create_store_tables, get_cold_watermark
+)
+
+# Number of symbol/timeframe downloads requested from MetaTrader 5 at once
+DOWNLOAD_WORKERS = 4
+
+# MetaTrader timeframe constants by their string representation, and back
+TIMEFRAME_CONSTANTS = {
+    "M1": mt5.TIMEFRAME_M1,
+    "M2": mt5.TIMEFRAME_M2,
+    "M3": mt5.TIMEFRAME_M3,
+    "M4": mt5.TIMEFRAME_M4,
+    "M5": mt5.TIMEFRAME_M5,
+    "M6": mt5.TIMEFRAME_M6,
+    "M10": mt5.TIMEFRAME_M10,
+    "M12": mt5.TIMEFRAME_M12,
+    "M15": mt5.TIMEFRAME_M15,
+    "M20": mt5.TIMEFRAME_M20,
+    "M30": mt5.TIMEFRAME_M30,
+    "H1": mt5.TIMEFRAME_H1,
+    "H2": mt5.TIMEFRAME_H2,
+    "H3": mt5.TIMEFRAME_H3,
+    "H4": mt5.TIMEFRAME_H4,
+    "H6": mt5.TIMEFRAME_H6,
+    "H8": mt5.TIMEFRAME_H8,
+    "H12": mt5.TIMEFRAME_H12,
+    "D1": mt5.TIMEFRAME_D1,
+    "W1": mt5.TIMEFRAME_W1,
+    "MN1": mt5.TIMEFRAME_MN1
+}
+TIMEFRAME_NAMES = {tf_const: tf_str for tf_str, tf_const in TIMEFRAME_CONSTANTS.items()}
+
+# Candles older than this many days are moved out of the candle tables into
+# compressed daily blocks in the candles_cold table
+COLD_AFTER_DAYS = 30
 
 def load_config(config_path):
     """
@@ -64,53 +100,69 @@ def create_db_connection(db_path):
     """
     conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE,
+        # which takes the write lock up front instead of upgrading it mid-transaction
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        
+        # WAL lets readers (API server) run alongside the writer, and
+        # synchronous=NORMAL drops the extra fsync per commit in WAL mode
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory map
+        
         print(f"Successfully connected to database at {db_path}")
         return conn
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
         return None
 
-def init_database(conn, symbols, timeframes):
+def init_database(conn, symbols, timeframes, symbol_digits):
     """
     Initialize database with tables for each symbol and timeframe combination.
     
     :param conn: SQLite connection object
     :param symbols: List of symbols
     :param timeframes: List of timeframes
+    :param symbol_digits: Dictionary mapping each symbol to its number of price digits
+    :return: Dictionary mapping each symbol to the digits its stored prices are scaled by,
+             or None if the tables couldn't be initialized
     """
     if conn is None:
-        return
+        return {}
         
     cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        # Symbol digits and the archive of old candles
+        stored_digits = create_store_tables(cursor, symbol_digits)
+        
+        # Create tables for each symbol and timeframe combination
+        converted = False
+        for symbol in symbols:
+            for timeframe in timeframes:
+                # Create a valid table name using the timeframe name (M1, H1, etc.)
+                table_name = f"{symbol}_{timeframe}"
+                
+                # Create table if it doesn't exist
+                if create_candle_table(cursor, table_name, stored_digits[symbol]):
+                    print(f"Converted table {table_name} to the integer price layout")
+                    converted = True
+        
+        cursor.execute("COMMIT")
+        
+        # Give the space freed by converted tables back to the file system
+        if converted:
+            conn.execute("VACUUM")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error initializing database tables: {e}")
+        return None
     
-    # Create tables for each symbol and timeframe combination
-    for symbol in symbols:
-        for timeframe in timeframes:
-            # Create a valid table name using the timeframe name (M1, H1, etc.)
-            table_name = f"{symbol}_{timeframe}"
-            
-            # Create table if it doesn't exist
-            cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS "{table_name}" (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                datetime TEXT UNIQUE,
-                time INTEGER,
-                open REAL,
-                high REAL,
-                low REAL,
-                close REAL,
-                tick_volume INTEGER,
-                spread INTEGER,
-                real_volume INTEGER
-            )
-            ''')
-            
-            # Create index for faster querying
-            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_datetime ON "{table_name}" (datetime)')
-    
-    conn.commit()
     print("Database tables initialized")
+    return stored_digits
 
 def get_timeframe_constant(timeframe_str):
     """
@@ -119,30 +171,7 @@ def get_timeframe_constant(timeframe_str):
     :param timeframe_str: String representation of the timeframe (e.g., "M1", "H1")
     :return: MetaTrader timeframe constant
     """
-    timeframe_dict = {
-        "M1": mt5.TIMEFRAME_M1,
-        "M2": mt5.TIMEFRAME_M2,
-        "M3": mt5.TIMEFRAME_M3,
-        "M4": mt5.TIMEFRAME_M4,
-        "M5": mt5.TIMEFRAME_M5,
-        "M6": mt5.TIMEFRAME_M6,
-        "M10": mt5.TIMEFRAME_M10,
-        "M12": mt5.TIMEFRAME_M12,
-        "M15": mt5.TIMEFRAME_M15,
-        "M20": mt5.TIMEFRAME_M20,
-        "M30": mt5.TIMEFRAME_M30,
-        "H1": mt5.TIMEFRAME_H1,
-        "H2": mt5.TIMEFRAME_H2,
-        "H3": mt5.TIMEFRAME_H3,
-        "H4": mt5.TIMEFRAME_H4,
-        "H6": mt5.TIMEFRAME_H6,
-        "H8": mt5.TIMEFRAME_H8,
-        "H12": mt5.TIMEFRAME_H12,
-        "D1": mt5.TIMEFRAME_D1,
-        "W1": mt5.TIMEFRAME_W1,
-        "MN1": mt5.TIMEFRAME_MN1
-    }
-    return timeframe_dict.get(timeframe_str)
+    return TIMEFRAME_CONSTANTS.get(timeframe_str)
 
 def get_timeframe_name(timeframe):
     """
@@ -151,34 +180,11 @@ def get_timeframe_name(timeframe):
     :param timeframe: MetaTrader timeframe constant
     :return: String representation of the timeframe
     """
-    timeframe_dict = {
-        mt5.TIMEFRAME_M1: "M1",
-        mt5.TIMEFRAME_M2: "M2",
-        mt5.TIMEFRAME_M3: "M3",
-        mt5.TIMEFRAME_M4: "M4",
-        mt5.TIMEFRAME_M5: "M5",
-        mt5.TIMEFRAME_M6: "M6",
-        mt5.TIMEFRAME_M10: "M10",
-        mt5.TIMEFRAME_M12: "M12",
-        mt5.TIMEFRAME_M15: "M15",
-        mt5.TIMEFRAME_M20: "M20",
-        mt5.TIMEFRAME_M30: "M30",
-        mt5.TIMEFRAME_H1: "H1",
-        mt5.TIMEFRAME_H2: "H2",
-        mt5.TIMEFRAME_H3: "H3",
-        mt5.TIMEFRAME_H4: "H4",
-        mt5.TIMEFRAME_H6: "H6",
-        mt5.TIMEFRAME_H8: "H8",
-        mt5.TIMEFRAME_H12: "H12",
-        mt5.TIMEFRAME_D1: "D1",
-        mt5.TIMEFRAME_W1: "W1",
-        mt5.TIMEFRAME_MN1: "MN1"
-    }
-    return timeframe_dict.get(timeframe, f"Unknown_{timeframe}")
+    return TIMEFRAME_NAMES.get(timeframe, f"Unknown_{timeframe}")
 
-def save_to_database(conn, symbol, timeframe, timeframe_str, data):
+def save_to_database(conn, symbol, timeframe, timeframe_str, data, symbol_meta):
     """
-    Save data to the database, avoiding duplicates based on datetime.
+    Save data to the database, avoiding duplicates based on time.
     Creates the table if it doesn't exist.
     
     :param conn: SQLite connection object
@@ -186,100 +192,66 @@ def save_to_database(conn, symbol, timeframe, timeframe_str, data):
     :param timeframe: MetaTrader timeframe constant
     :param timeframe_str: String representation of timeframe (M1, H1, etc.)
     :param data: Numpy array with candle data
+    :param symbol_meta: Cached symbol properties; its digits are the number of
+                        price digits the stored prices are scaled by
     :return: Tuple (total_rows, inserted_rows)
     """
     if conn is None or data is None or len(data) == 0:
         return 0, 0
-        
-    # Convert numpy array to pandas DataFrame for easier manipulation
-    df = pd.DataFrame(data)
-    
-    # Convert the time column (Unix timestamp) to datetime format
-    df['datetime'] = pd.to_datetime(df['time'], unit='s')
     
-    # Format datetime to string for storage and comparison
-    df['datetime_str'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    digits = symbol_meta["digits"]
     
     # Remove the last (current) candle which might be incomplete
-    df = df.iloc[:-1]
+    data = data[:-1]
     
-    if df.empty:
+    if len(data) == 0:
         print(f"No complete candles found for {symbol} {timeframe_str}")
         return 0, 0
     
     # Get the table name for this symbol and timeframe
     table_name = f"{symbol}_{timeframe_str}"
     
-    cursor = conn.cursor()
+    total_rows = len(data)
     
-    # Ensure the table exists - create it if it doesn't
-    try:
-        # Try to query the table
-        cursor.execute(f'SELECT name FROM sqlite_master WHERE type="table" AND name="{table_name}"')
-        table_exists = cursor.fetchone() is not None
-        
-        if not table_exists:
-            print(f"Table {table_name} doesn't exist. Creating it now...")
-            # Create the table
-            cursor.execute(f'''
-            CREATE TABLE "{table_name}" (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                datetime TEXT UNIQUE,
-                time INTEGER,
-                open REAL,
-                high REAL,
-                low REAL,
-                close REAL,
-                tick_volume INTEGER,
-                spread INTEGER,
-                real_volume INTEGER
-            )
-            ''')
-            
-            # Create index for faster querying
-            cursor.execute(f'CREATE INDEX idx_{table_name}_datetime ON "{table_name}" (datetime)')
-            conn.commit()
-            print(f"Table {table_name} created successfully")
-    except sqlite3.Error as e:
-        print(f"Error checking/creating table {table_name}: {e}")
-        return 0, 0
+    # Skip candles of days that were already archived
+    data = data[data['time'] >= get_cold_watermark(conn.cursor(), symbol, timeframe_str)]
     
-    total_rows = len(df)
-    inserted_rows = 0
+    # Store prices as integers in units of the symbol's last digit, converting
+    # whole fields of the structured array at once
+    scale = 10 ** digits
+    prices = [np.rint(data[field] * scale).astype(np.int64) for field in ('open', 'high', 'low', 'close')]
     
-    # Check which datetimes already exist in the database
-    existing_datetimes = set()
+    no_values = np.zeros(len(data), dtype=np.int64)
+    spread = data['spread'] if 'spread' in data.dtype.names else no_values
+    real_volume = data['real_volume'] if 'real_volume' in data.dtype.names else no_values
+
+    # Build the parameter tuples from plain Python lists (sqlite3 can't bind NumPy integers)
+    rows = list(zip(
+        data['time'].astype(np.int64).tolist(),
+        *(price.tolist() for price in prices),
+        data['tick_volume'].astype(np.int64).tolist(),
+        spread.astype(np.int64).tolist(),
+        real_volume.astype(np.int64).tolist()
+    ))
+
+    # Create the table if needed and insert all candles in a single
+    # transaction; the time primary key makes SQLite skip the ones that
+    # already exist
+    cursor = conn.cursor()
     try:
-        cursor.execute(f'SELECT datetime FROM "{table_name}"')
-        for row in cursor.fetchall():
-            existing_datetimes.add(row[0])
+        cursor.execute("BEGIN IMMEDIATE")
+        create_candle_table(cursor, table_name, digits)
+        cursor.executemany(f'''
+        INSERT OR IGNORE INTO "{table_name}" (time, open, high, low, close, tick_volume, spread, real_volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        inserted_rows = cursor.rowcount
+        cursor.execute("COMMIT")
     except sqlite3.Error as e:
-        print(f"Error retrieving existing datetimes: {e}")
-        # Continue with an empty set - will attempt to insert all rows
-    
-    # Insert rows that don't already exist in the database
-    for _, row in df.iterrows():
-        if row['datetime_str'] not in existing_datetimes:
-            try:
-                cursor.execute(f'''
-                INSERT INTO "{table_name}" (datetime, time, open, high, low, close, tick_volume, spread, real_volume)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    row['datetime_str'],
-                    int(row['time']),
-                    float(row['open']),
-                    float(row['high']),
-                    float(row['low']),
-                    float(row['close']),
-                    int(row['tick_volume']),
-                    int(row['spread']) if 'spread' in row and not np.isnan(row['spread']) else 0,
-                    int(row['real_volume']) if 'real_volume' in row and not np.isnan(row['real_volume']) else 0
-                ))
-                inserted_rows += 1
-            except sqlite3.Error as e:
-                print(f"Error inserting row: {e}")
-    
-    conn.commit()
+        conn.rollback()
+        print(f"Error inserting candles into {table_name}: {e}")
+        return total_rows, 0
+
     print(f"Saved {inserted_rows} new candles out of {total_rows} for {symbol} {timeframe_str}")
     return total_rows, inserted_rows
 
@@ -291,11 +263,6 @@ def download_data(symbol, timeframe):
     :param timeframe: MetaTrader timeframe constant
     :return: Numpy array with candle data
     """
-    # Select the symbol in Market Watch to ensure we can get data
-    if not mt5.symbol_select(symbol, True):
-        print(f"Failed to select {symbol} in Market Watch")
-        return None
-        
     print(f"Downloading data for {symbol} {get_timeframe_name(timeframe)}...")
     rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, 99999)
     
@@ -360,27 +327,73 @@ def main():
         mt5.shutdown()
         return
     
+    # Select each symbol in Market Watch once, so we can get its data, and
+    # cache its properties (digits are used to store prices as integers)
+    symbol_meta = {}
+    for symbol in symbols:
+        if not mt5.symbol_select(symbol, True):
+            print(f"Failed to select {symbol} in Market Watch, skipping")
+            continue
+        info = mt5.symbol_info(symbol)
+        if info is None:
+            print(f"Warning: Symbol {symbol} not found, skipping")
+            continue
+        symbol_meta[symbol] = info._asdict()
+    symbols = [symbol for symbol in symbols if symbol in symbol_meta]
+    
     # Initialize database tables (using timeframe strings directly)
-    init_database(conn, symbols, [tf_str for _, tf_str in timeframes])
+    symbol_digits = {symbol: meta["digits"] for symbol, meta in symbol_meta.items()}
+    symbol_digits = init_database(conn, symbols, [tf_str for _, tf_str in timeframes], symbol_digits)
+    if symbol_digits is None:
+        conn.close()
+        mt5.shutdown()
+        return
+    
+    # Existing tables keep the digits they were first stored with
+    for symbol, digits in symbol_digits.items():
+        symbol_meta[symbol]["digits"] = digits
     
     # Track total statistics
     total_downloaded = 0
     total_inserted = 0
     
-    # Process each symbol and timeframe
-    for symbol in symbols:
-        for tf_const, tf_str in timeframes:
-            # Download historical data
-            data = download_data(symbol, tf_const)
+    # Download all symbol/timeframe combinations concurrently; the MT5 calls are
+    # I/O bound, while saving stays on this thread so SQLite has a single writer
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        futures = {
+            executor.submit(download_data, symbol, tf_const): (symbol, tf_const, tf_str)
+            for symbol in symbols
+            for tf_const, tf_str in timeframes
+        }
+        
+        for future in as_completed(futures):
+            symbol, tf_const, tf_str = futures[future]
+            data = future.result()
             
             if data is not None:
                 # Save to database
-                downloaded, inserted = save_to_database(conn, symbol, tf_const, tf_str, data)
+                downloaded, inserted = save_to_database(conn, symbol, tf_const, tf_str, data, symbol_meta[symbol])
                 total_downloaded += downloaded
                 total_inserted += inserted
-                
-            # Small delay to avoid overwhelming the server
-            time.sleep(1)
+    
+    # Move candles older than COLD_AFTER_DAYS (whole days) into compressed blocks
+    now = int(time.time())
+    cutoff = now - now % SECONDS_PER_DAY - COLD_AFTER_DAYS * SECONDS_PER_DAY
+    total_archived = 0
+    cursor = conn.cursor()
+    for symbol in symbols:
+        for _, tf_str in timeframes:
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                archived = archive_cold_candles(cursor, symbol, tf_str, cutoff)
+                cursor.execute("COMMIT")
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"Error archiving candles of {symbol}_{tf_str}: {e}")
+                continue
+            total_archived += archived
+    if total_archived:
+        print(f"Archived {total_archived} candles older than {COLD_AFTER_DAYS} days")
     
     # Close database connection
     conn.close()
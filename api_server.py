@@ -1,20 +1,28 @@
+import asyncio
 import os
 import sqlite3
-from datetime import datetime, timedelta
+from pathlib import Path
+from datetime import datetime
 from typing import List, Optional, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Query
+import aiosqlite
+from cachetools import TTLCache
+from fastapi import Depends, FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
+from fastapi.responses import ORJSONResponse
+import numpy as np
 import uvicorn
 import pytz
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
+
+from AutoTrader.candle_store import COLD_COLUMNS, decode_candle_block
 
 # Create FastAPI instance
 app = FastAPI(
     title="MT5 Data API",
     description="API for accessing MetaTrader 5 historical data",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware to allow cross-origin requests
@@ -30,6 +38,26 @@ app.add_middleware(
 current_dir = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(current_dir, "mt5_historical_data.db")
 
+# Long-lived read connections shared across requests, so each request
+# reuses a warm page cache instead of reopening the database file
+POOL_SIZE = os.cpu_count() or 4
+
+# Candle table names, re-read from sqlite_master only when the database changes
+table_cache = {"mtime": None, "tables": [], "scales": {}, "digits": {}, "cold": False}
+
+# Responses of the endpoints dashboards poll, kept until they expire or the
+# database changes
+response_cache = TTLCache(maxsize=1024, ttl=30)
+
+# Rows fetched from SQLite per batch when reading candles
+FETCH_BATCH_SIZE = 2048
+
+# Row layout of the /ohlc query: time, open, high, low, close, tick_volume
+OHLC_DTYPE = [('t', 'i8'), ('o', 'f8'), ('h', 'f8'), ('l', 'f8'), ('c', 'f8'), ('v', 'i8')]
+
+# Tables aggregated per /info query (SQLite allows at most 500 compound SELECTs)
+INFO_TABLES_PER_QUERY = 400
+
 # Pydantic models for response validation
 class CandleData(BaseModel):
     datetime: str
@@ -54,15 +82,253 @@ class DatabaseInfo(BaseModel):
     oldest_candle: Optional[str]
     newest_candle: Optional[str]
 
-def get_db_connection():
-    """Create a connection to the SQLite database"""
+async def get_db_connection():
+    """Create a read-only connection to the SQLite database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row  # Use row factory for dict-like results
+        # Open read-only so several API readers can share the writer's WAL
+        conn = await aiosqlite.connect(f"{Path(DB_PATH).as_uri()}?mode=ro", uri=True)
+        try:
+            conn.row_factory = aiosqlite.Row  # Use row factory for dict-like results
+            await conn.execute("PRAGMA query_only=1")
+            await conn.execute("PRAGMA temp_store=MEMORY")
+            await conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+            await conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory map
+        except Exception:
+            await conn.close()
+            raise
         return conn
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
 
+class AsyncConnectionPool:
+    """
+    Pool of aiosqlite connections. Each connection runs its queries on its
+    own thread, so requests don't block the event loop while SQLite works.
+    Connections are opened on startup; any that couldn't be opened then
+    (e.g. the database doesn't exist yet) are opened on first use.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self.opened = 0
+        self.idle = None
+    
+    async def open(self):
+        """Open the pool's connections on the running event loop"""
+        self.idle = asyncio.Queue()
+        try:
+            while self.opened < self.size:
+                self.idle.put_nowait(await get_db_connection())
+                self.opened += 1
+        except HTTPException:
+            # Leave the remaining connections to acquire()
+            pass
+    
+    async def acquire(self):
+        """Get an idle connection, opening a new one if the pool isn't full yet"""
+        if self.idle.empty() and self.opened < self.size:
+            self.opened += 1
+            try:
+                return await get_db_connection()
+            except Exception:
+                self.opened -= 1
+                raise
+        return await self.idle.get()
+    
+    def release(self, conn):
+        """Return a connection to the pool"""
+        self.idle.put_nowait(conn)
+    
+    async def close(self):
+        """Close all idle connections"""
+        while not self.idle.empty():
+            await self.idle.get_nowait().close()
+            self.opened -= 1
+
+connection_pool = AsyncConnectionPool(POOL_SIZE)
+
+@app.on_event("startup")
+async def open_connection_pool():
+    """Prepare the database connection pool"""
+    await connection_pool.open()
+
+@app.on_event("shutdown")
+async def close_connection_pool():
+    """Close all pooled database connections"""
+    await connection_pool.close()
+
+async def get_db():
+    """Borrow a pooled database connection for the duration of a request"""
+    conn = await connection_pool.acquire()
+    try:
+        yield conn
+    finally:
+        connection_pool.release(conn)
+
+def get_database_mtime():
+    """Get the latest modification time of the database file and its WAL"""
+    mtime = 0
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            mtime = max(mtime, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    return mtime
+
+def get_cached_response(key):
+    """
+    Look up a cached endpoint response
+    
+    :param key: Tuple of the endpoint name and its parameters
+    :return: Tuple (mtime, response), response is None unless it was cached
+             for the current state of the database
+    """
+    mtime = get_database_mtime()
+    entry = response_cache.get(key)
+    if entry is not None and entry[0] == mtime:
+        return mtime, entry[1]
+    return mtime, None
+
+async def get_tables(conn):
+    """Get the candle table names, refreshing the cache if the database changed"""
+    mtime = get_database_mtime()
+    if mtime != table_cache["mtime"]:
+        # Candle tables are the ones with an "open" column; its declared type
+        # tells whether prices are stored as scaled INTEGERs or as REALs
+        cursor = await conn.execute("""
+            SELECT m.name, p.type FROM sqlite_master AS m, pragma_table_info(m.name) AS p
+            WHERE m.type = 'table' AND p.name = 'open'
+            ORDER BY m.rowid
+        """)
+        price_types = [tuple(row) for row in await cursor.fetchall()]
+        
+        # Number of price digits of each symbol stored as integers
+        try:
+            cursor = await conn.execute("SELECT symbol, digits FROM symbols")
+            symbol_digits = {row[0]: row[1] for row in await cursor.fetchall()}
+        except sqlite3.OperationalError:
+            symbol_digits = {}
+        
+        # Old candles may have been moved into compressed daily blocks
+        cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'candles_cold'")
+        has_cold = await cursor.fetchone() is not None
+        
+        scales = {}
+        for table, price_type in price_types:
+            # Symbols may contain "_" (e.g. US30_cash), timeframes never do
+            digits = symbol_digits.get(table.rsplit('_', 1)[0])
+            if price_type.upper() == "INTEGER" and digits is not None:
+                scales[table] = 10.0 ** digits
+            else:
+                scales[table] = 1.0
+        
+        table_cache.update(mtime=mtime, tables=[table for table, _ in price_types], scales=scales, digits=symbol_digits, cold=has_cold)
+    return table_cache["tables"]
+
+async def get_price_scale(conn, table_name):
+    """
+    Get the factor a candle table's stored prices are divided by,
+    or None if the table doesn't exist
+    """
+    await get_tables(conn)
+    return table_cache["scales"].get(table_name)
+
+def get_cold_price_scale(symbol):
+    """
+    Get the factor the archived prices of a symbol are divided by; archived
+    prices are always integers scaled by the symbol's digits
+    """
+    digits = table_cache["digits"].get(symbol)
+    return 1.0 if digits is None else 10.0 ** digits
+
+def candle_columns(scale):
+    """Build the select list returning a candle with float prices"""
+    return (
+        "time, "
+        f"open / {scale!r} AS open, high / {scale!r} AS high, low / {scale!r} AS low, close / {scale!r} AS close, "
+        "tick_volume, spread, real_volume, is_completed"
+    )
+
+async def read_cold_candles(conn, symbol, timeframe, start, end, limit):
+    """
+    Read the newest archived candles of a symbol and timeframe
+    
+    :param conn: Database connection
+    :param symbol: Trading symbol
+    :param timeframe: Timeframe (e.g., M1, H1)
+    :param start: Optional Unix timestamp of the oldest candle to return
+    :param end: Optional Unix timestamp of the newest candle to return
+    :param limit: Maximum number of candles to return
+    :return: int64 array with one row per column of COLD_COLUMNS, newest candle first
+    """
+    await get_tables(conn)
+    blocks = []
+    count = 0
+    if table_cache["cold"] and limit > 0:
+        query = "SELECT payload FROM candles_cold WHERE symbol = ? AND timeframe = ?"
+        params = [symbol, timeframe]
+        if start is not None:
+            query += " AND last_time >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND first_time <= ?"
+            params.append(end)
+        query += " ORDER BY day DESC"
+        
+        # Decompress day by day, newest first, until enough candles are read
+        cursor = await conn.execute(query, params)
+        while count < limit:
+            row = await cursor.fetchone()
+            if row is None:
+                break
+            columns = decode_candle_block(row[0])
+            if start is not None:
+                columns = columns[:, columns[0] >= start]
+            if end is not None:
+                columns = columns[:, columns[0] <= end]
+            blocks.append(columns[:, ::-1])
+            count += columns.shape[1]
+        await cursor.close()
+    
+    if not blocks:
+        return np.empty((len(COLD_COLUMNS), 0), dtype=np.int64)
+    return np.concatenate(blocks, axis=1)[:, :limit]
+
+def add_datetimes(candles):
+    """
+    Add the 'YYYY-MM-DD HH:MM:SS' (UTC) datetime string of each candle, derived
+    from its Unix time for all candles at once instead of by SQLite row by row
+    
+    :param candles: List of candle dictionaries with a time key
+    :return: The same list
+    """
+    if not candles:
+        return candles
+    
+    times = np.fromiter((candle["time"] for candle in candles), dtype=np.int64, count=len(candles))
+    datetimes = np.char.replace(np.datetime_as_string(times.astype('datetime64[s]')), 'T', ' ')
+    for candle, candle_datetime in zip(candles, datetimes.tolist()):
+        candle["datetime"] = candle_datetime
+    return candles
+
+def parse_time_bound(value, name):
+    """
+    Convert a 'YYYY-MM-DD HH:MM:SS' (UTC) query parameter to a Unix timestamp,
+    so time filters compare the integer time key instead of formatted strings
+    
+    :param value: Datetime string from the request
+    :param name: Name of the query parameter, for the error message
+    :return: Unix timestamp in seconds
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: expected format 'YYYY-MM-DD HH:MM:SS'")
+    
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=pytz.UTC)
+    return int(parsed.timestamp())
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -80,115 +346,132 @@ async def root():
     }
 
 @app.get("/info", response_model=DatabaseInfo)
-async def get_database_info():
+async def get_database_info(conn: aiosqlite.Connection = Depends(get_db)):
     """Get information about the database content"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # Get all tables in the database
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        # Organize tables by symbol and timeframe
-        symbols_dict = {}
-        for table in tables:
-            parts = table.split('_')
-            if len(parts) >= 2:
-                symbol = parts[0]
-                timeframe = '_'.join(parts[1:])
-                
-                if symbol not in symbols_dict:
-                    symbols_dict[symbol] = []
-                
-                symbols_dict[symbol].append(timeframe)
+    mtime, cached = get_cached_response(("info",))
+    if cached is not None:
+        return cached
+    
+    cursor = await conn.cursor()
+    
+    # Get all tables in the database
+    tables = await get_tables(conn)
+    
+    # Organize tables by symbol and timeframe
+    symbols_dict = {}
+    for table in tables:
+        parts = table.split('_')
+        if len(parts) >= 2:
+            symbol = parts[0]
+            timeframe = '_'.join(parts[1:])
+            
+            if symbol not in symbols_dict:
+                symbols_dict[symbol] = []
+            
+            symbols_dict[symbol].append(timeframe)
+    
+    symbols_info = [SymbolInfo(symbol=symbol, timeframes=timeframes) for symbol, timeframes in symbols_dict.items()]
+    
+    # Count candles and find the oldest/newest candle of every table in
+    # a single UNION ALL query (batched to stay below SQLite's compound
+    # SELECT limit)
+    total_candles = 0
+    oldest_datetime = None
+    newest_datetime = None
+    
+    for i in range(0, len(tables), INFO_TABLES_PER_QUERY):
+        batch = tables[i:i + INFO_TABLES_PER_QUERY]
+        query = " UNION ALL ".join(
+            f"SELECT COUNT(*), strftime('%Y-%m-%d %H:%M:%S', MIN(time), 'unixepoch'), "
+            f"strftime('%Y-%m-%d %H:%M:%S', MAX(time), 'unixepoch') FROM \"{table}\""
+            for table in batch
+        )
+        try:
+            await cursor.execute(query)
+        except sqlite3.Error as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
         
-        symbols_info = [SymbolInfo(symbol=symbol, timeframes=timeframes) for symbol, timeframes in symbols_dict.items()]
+        for count, oldest, newest in await cursor.fetchall():
+            total_candles += count
+            
+            if oldest and (oldest_datetime is None or oldest < oldest_datetime):
+                oldest_datetime = oldest
+            
+            if newest and (newest_datetime is None or newest > newest_datetime):
+                newest_datetime = newest
+    
+    # Add the candles archived in compressed daily blocks
+    if table_cache["cold"]:
+        try:
+            await cursor.execute(
+                "SELECT COALESCE(SUM(candles), 0), strftime('%Y-%m-%d %H:%M:%S', MIN(first_time), 'unixepoch'), "
+                "strftime('%Y-%m-%d %H:%M:%S', MAX(last_time), 'unixepoch') FROM candles_cold"
+            )
+        except sqlite3.Error as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
         
-        # Count total candles
-        total_candles = 0
-        oldest_datetime = None
-        newest_datetime = None
+        count, oldest, newest = await cursor.fetchone()
+        total_candles += count
         
-        for table in tables:
-            try:
-                cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
-                count = cursor.fetchone()[0]
-                total_candles += count
-                
-                # Get oldest and newest candle
-                if count > 0:
-                    cursor.execute(f'SELECT datetime FROM "{table}" ORDER BY time ASC LIMIT 1')
-                    oldest = cursor.fetchone()
-                    
-                    cursor.execute(f'SELECT datetime FROM "{table}" ORDER BY time DESC LIMIT 1')
-                    newest = cursor.fetchone()
-                    
-                    if oldest and (oldest_datetime is None or oldest[0] < oldest_datetime):
-                        oldest_datetime = oldest[0]
-                    
-                    if newest and (newest_datetime is None or newest[0] > newest_datetime):
-                        newest_datetime = newest[0]
-            except sqlite3.Error:
-                # Skip tables that don't have expected structure
-                continue
+        if oldest and (oldest_datetime is None or oldest < oldest_datetime):
+            oldest_datetime = oldest
         
-        return DatabaseInfo(
-            symbols=symbols_info,
-            total_tables=len(tables),
-            total_candles=total_candles,
-            oldest_candle=oldest_datetime,
-            newest_candle=newest_datetime
-        )
-    finally:
-        conn.close()
+        if newest and (newest_datetime is None or newest > newest_datetime):
+            newest_datetime = newest
+    
+    info = DatabaseInfo(
+        symbols=symbols_info,
+        total_tables=len(tables),
+        total_candles=total_candles,
+        oldest_candle=oldest_datetime,
+        newest_candle=newest_datetime
+    )
+    response_cache[("info",)] = (mtime, info)
+    return info
 
 @app.get("/symbols", response_model=List[str])
-async def get_symbols():
+async def get_symbols(conn: aiosqlite.Connection = Depends(get_db)):
     """Get list of available symbols"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # Get all tables in the database
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        # Extract unique symbols
-        symbols = set()
-        for table in tables:
-            parts = table.split('_')
-            if len(parts) >= 2:
-                symbols.add(parts[0])
-        
-        return sorted(list(symbols))
-    finally:
-        conn.close()
+    mtime, cached = get_cached_response(("symbols",))
+    if cached is not None:
+        return cached
+    
+    # Get all tables in the database
+    tables = await get_tables(conn)
+    
+    # Extract unique symbols
+    symbols = set()
+    for table in tables:
+        parts = table.split('_')
+        if len(parts) >= 2:
+            symbols.add(parts[0])
+    
+    symbols = sorted(list(symbols))
+    response_cache[("symbols",)] = (mtime, symbols)
+    return symbols
 
 @app.get("/timeframes", response_model=List[str])
-async def get_timeframes(symbol: str):
+async def get_timeframes(symbol: str, conn: aiosqlite.Connection = Depends(get_db)):
     """Get list of available timeframes for a symbol"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # Get all tables in the database
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        # Find timeframes for the given symbol
-        timeframes = []
-        for table in tables:
-            parts = table.split('_')
-            if len(parts) >= 2 and parts[0] == symbol:
-                timeframes.append('_'.join(parts[1:]))
-        
-        if not timeframes:
-            raise HTTPException(status_code=404, detail=f"No data found for symbol: {symbol}")
-        
-        return timeframes
-    finally:
-        conn.close()
+    mtime, cached = get_cached_response(("timeframes", symbol))
+    if cached is not None:
+        return cached
+    
+    # Get all tables in the database
+    tables = await get_tables(conn)
+    
+    # Find timeframes for the given symbol
+    timeframes = []
+    for table in tables:
+        parts = table.split('_')
+        if len(parts) >= 2 and parts[0] == symbol:
+            timeframes.append('_'.join(parts[1:]))
+    
+    if not timeframes:
+        raise HTTPException(status_code=404, detail=f"No data found for symbol: {symbol}")
+    
+    response_cache[("timeframes", symbol)] = (mtime, timeframes)
+    return timeframes
 
 @app.get("/candles", response_model=List[CandleData])
 async def get_candles(
@@ -196,8 +479,9 @@ async def get_candles(
     timeframe: str,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
-    limit: Optional[int] = Query(default=100, le=100000),
+    limit: Optional[int] = Query(default=100, ge=1, le=100000),
     completed_only: Optional[bool] = False,
+    conn: aiosqlite.Connection = Depends(get_db),
 ):
     """
     Get candle data for a symbol and timeframe
@@ -210,80 +494,105 @@ async def get_candles(
     - **completed_only**: If true, return only completed candles
     """
     table_name = f"{symbol}_{timeframe}"
-    query = f'SELECT * FROM "{table_name}"'
     params = []
     
     # Add time filters if specified
     conditions = []
-    if start_time:
-        conditions.append("datetime >= ?")
-        params.append(start_time)
-    if end_time:
-        conditions.append("datetime <= ?")
-        params.append(end_time)
+    start = parse_time_bound(start_time, "start_time") if start_time else None
+    end = parse_time_bound(end_time, "end_time") if end_time else None
+    if start is not None:
+        conditions.append("time >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("time <= ?")
+        params.append(end)
     if completed_only:
         conditions.append("is_completed = 1")
     
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    
-    query += " ORDER BY time DESC LIMIT ?"
-    params.append(limit)
-    
-    conn = get_db_connection()
     try:
         # Check if table exists
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        if not cursor.fetchone():
+        scale = await get_price_scale(conn, table_name)
+        if scale is None:
             raise HTTPException(status_code=404, detail=f"No data found for {symbol} with timeframe {timeframe}")
         
+        query = f'SELECT {candle_columns(scale)} FROM "{table_name}"'
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        query += " ORDER BY time DESC LIMIT ?"
+        params.append(limit)
+        
         # Execute query
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        cursor = await conn.cursor()
+        cursor.arraysize = FETCH_BATCH_SIZE
+        await cursor.execute(query, params)
         
-        # Convert to list of dictionaries
+        # Convert to list of dictionaries, fetching rows in batches
         result = []
-        for row in rows:
-            result.append(dict(row))
+        while True:
+            rows = await cursor.fetchmany()
+            if not rows:
+                break
+            result.extend(map(dict, rows))
+        
+        # Continue with the archived candles older than the candle table's
+        if len(result) < limit:
+            cold_end = result[-1]["time"] - 1 if result else end
+            cold = await read_cold_candles(conn, symbol, timeframe, start, cold_end, limit - len(result))
+            cold_scale = get_cold_price_scale(symbol)
+            result.extend(
+                {
+                    "time": t,
+                    "open": o / cold_scale,
+                    "high": h / cold_scale,
+                    "low": l / cold_scale,
+                    "close": c / cold_scale,
+                    "tick_volume": v,
+                    "spread": spread,
+                    "real_volume": real_volume,
+                    "is_completed": 1
+                }
+                for t, o, h, l, c, v, spread, real_volume in cold.T.tolist()
+            )
         
-        return result
+        return add_datetimes(result)
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 @app.get("/latest", response_model=CandleData)
-async def get_latest_candle(symbol: str, timeframe: str):
+async def get_latest_candle(symbol: str, timeframe: str, conn: aiosqlite.Connection = Depends(get_db)):
     """
     Get the latest candle for a symbol and timeframe
     
     - **symbol**: Trading symbol (e.g., EURUSD)
     - **timeframe**: Timeframe (e.g., M1, H1)
     """
+    mtime, cached = get_cached_response(("latest", symbol, timeframe))
+    if cached is not None:
+        return cached
+    
     table_name = f"{symbol}_{timeframe}"
-    query = f'SELECT * FROM "{table_name}" ORDER BY time DESC LIMIT 1'
     
-    conn = get_db_connection()
     try:
         # Check if table exists
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        if not cursor.fetchone():
+        scale = await get_price_scale(conn, table_name)
+        if scale is None:
             raise HTTPException(status_code=404, detail=f"No data found for {symbol} with timeframe {timeframe}")
         
+        query = f'SELECT {candle_columns(scale)} FROM "{table_name}" ORDER BY time DESC LIMIT 1'
+        
         # Execute query
-        cursor.execute(query)
-        row = cursor.fetchone()
+        cursor = await conn.execute(query)
+        row = await cursor.fetchone()
         
         if not row:
             raise HTTPException(status_code=404, detail=f"No candles found for {symbol} with timeframe {timeframe}")
         
-        return dict(row)
+        candle = add_datetimes([dict(row)])[0]
+        response_cache[("latest", symbol, timeframe)] = (mtime, candle)
+        return candle
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 @app.get("/ohlc", response_model=Dict[str, Any])
 async def get_ohlc_data(
@@ -291,8 +600,9 @@ async def get_ohlc_data(
     timeframe: str,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None,
-    limit: Optional[int] = Query(default=100, le=100000),
+    limit: Optional[int] = Query(default=100, ge=1, le=100000),
     completed_only: Optional[bool] = False,
+    conn: aiosqlite.Connection = Depends(get_db),
 ):
     """
     Get OHLC data for charting libraries in a simplified format
@@ -305,79 +615,86 @@ async def get_ohlc_data(
     - **completed_only**: If true, return only completed candles
     """
     table_name = f"{symbol}_{timeframe}"
-    query = f'SELECT time, open, high, low, close, tick_volume FROM "{table_name}"'
     params = []
     
     # Add time filters if specified
     conditions = []
-    if start_time:
-        conditions.append("datetime >= ?")
-        params.append(start_time)
-    if end_time:
-        conditions.append("datetime <= ?")
-        params.append(end_time)
+    start = parse_time_bound(start_time, "start_time") if start_time else None
+    end = parse_time_bound(end_time, "end_time") if end_time else None
+    if start is not None:
+        conditions.append("time >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("time <= ?")
+        params.append(end)
     if completed_only:
         conditions.append("is_completed = 1")
     
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    
-    query += " ORDER BY time DESC LIMIT ?"
-    params.append(limit)
-    
-    conn = get_db_connection()
     try:
         # Check if table exists
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        if not cursor.fetchone():
+        scale = await get_price_scale(conn, table_name)
+        if scale is None:
             raise HTTPException(status_code=404, detail=f"No data found for {symbol} with timeframe {timeframe}")
         
-        # Execute query
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        query = (
+            f'SELECT time, open / {scale!r}, high / {scale!r}, low / {scale!r}, close / {scale!r}, tick_volume '
+            f'FROM "{table_name}"'
+        )
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
         
-        if not rows:
-            raise HTTPException(status_code=404, detail=f"No candles found for {symbol} with timeframe {timeframe}")
+        query += " ORDER BY time DESC LIMIT ?"
+        params.append(limit)
+        
+        # Execute query, streaming the rows in batches into a preallocated
+        # structured array
+        cursor = await conn.cursor()
+        cursor.row_factory = None
+        cursor.arraysize = FETCH_BATCH_SIZE
+        await cursor.execute(query, params)
         
-        # Format data for charting libraries
-        times = []
-        opens = []
-        highs = []
-        lows = []
-        closes = []
-        volumes = []
+        candles = np.empty(limit, dtype=OHLC_DTYPE)
+        count = 0
+        while True:
+            rows = await cursor.fetchmany()
+            if not rows:
+                break
+            candles[count:count + len(rows)] = rows
+            count += len(rows)
         
-        for row in rows:
-            times.append(row[0] * 1000)  # Convert to milliseconds for JS
-            opens.append(row[1])
-            highs.append(row[2])
-            lows.append(row[3])
-            closes.append(row[4])
-            volumes.append(row[5])
+        # Continue with the archived candles older than the candle table's
+        if count < limit:
+            cold_end = int(candles['t'][count - 1]) - 1 if count else end
+            cold = await read_cold_candles(conn, symbol, timeframe, start, cold_end, limit - count)
+            cold_scale = get_cold_price_scale(symbol)
+            cold_count = cold.shape[1]
+            candles['t'][count:count + cold_count] = cold[0]
+            for field, column in zip(('o', 'h', 'l', 'c'), cold[1:5]):
+                candles[field][count:count + cold_count] = column / cold_scale
+            candles['v'][count:count + cold_count] = cold[5]
+            count += cold_count
+        candles = candles[:count]
         
-        # Reverse to get chronological order
-        times.reverse()
-        opens.reverse()
-        highs.reverse()
-        lows.reverse()
-        closes.reverse()
-        volumes.reverse()
+        if count == 0:
+            raise HTTPException(status_code=404, detail=f"No candles found for {symbol} with timeframe {timeframe}")
+        
+        # Reverse to get chronological order (a view, no copy)
+        candles = candles[::-1]
         
-        return {
+        # Format data for charting libraries; orjson serializes the NumPy
+        # arrays directly, which needs them to be contiguous
+        return ORJSONResponse({
             "symbol": symbol,
             "timeframe": timeframe,
-            "t": times,
-            "o": opens,
-            "h": highs,
-            "l": lows,
-            "c": closes,
-            "v": volumes
-        }
+            "t": candles['t'] * 1000,  # Convert to milliseconds for JS
+            "o": np.ascontiguousarray(candles['o']),
+            "h": np.ascontiguousarray(candles['h']),
+            "l": np.ascontiguousarray(candles['l']),
+            "c": np.ascontiguousarray(candles['c']),
+            "v": np.ascontiguousarray(candles['v'])
+        })
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        conn.close()
 
 if __name__ == "__main__":
     uvicorn.run("api_server:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
@@ -2,34 +2,148 @@ import time
 import json
 import os
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import MetaTrader5 as mt5
-import pandas as pd
 import numpy as np
 import pytz
 import logging
+import logging.handlers
+import atexit
+import queue
 import signal
 import sys
+from AutoTrader.candle_store import (
+    SECONDS_PER_DAY, archive_cold_candles, create_candle_table, create_store_tables, get_cold_watermark
+)
+
+# Setup logging: records are put on a queue and written to the file and the
+# console by a background thread, so the update loop never waits on disk
+log_queue = queue.Queue(-1)
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler("live_updater.log"), logging.StreamHandler()]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
 
-# Setup logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("live_updater.log"),
-        logging.StreamHandler()
-    ]
+    format='%(message)s',  # Formatted by the listener's handlers
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
 # Global variable to control the main loop
 running = True
 
+# Set on shutdown to wake the main loop from its sleep
+shutdown_event = threading.Event()
+
+# A symbol whose quotes haven't changed for this many seconds is treated as
+# closed, and its quotes are then only checked every MARKET_RECHECK_SECONDS
+MARKET_IDLE_SECONDS = 300
+MARKET_RECHECK_SECONDS = 60
+
+# Seconds to wait after a candle boundary so the terminal has the new candle
+CANDLE_CLOSE_DELAY = 0.2
+
+# MetaTrader timeframe constants by their string representation, and back
+TIMEFRAME_CONSTANTS = {
+    "M1": mt5.TIMEFRAME_M1,
+    "M2": mt5.TIMEFRAME_M2,
+    "M3": mt5.TIMEFRAME_M3,
+    "M4": mt5.TIMEFRAME_M4,
+    "M5": mt5.TIMEFRAME_M5,
+    "M6": mt5.TIMEFRAME_M6,
+    "M10": mt5.TIMEFRAME_M10,
+    "M12": mt5.TIMEFRAME_M12,
+    "M15": mt5.TIMEFRAME_M15,
+    "M20": mt5.TIMEFRAME_M20,
+    "M30": mt5.TIMEFRAME_M30,
+    "H1": mt5.TIMEFRAME_H1,
+    "H2": mt5.TIMEFRAME_H2,
+    "H3": mt5.TIMEFRAME_H3,
+    "H4": mt5.TIMEFRAME_H4,
+    "H6": mt5.TIMEFRAME_H6,
+    "H8": mt5.TIMEFRAME_H8,
+    "H12": mt5.TIMEFRAME_H12,
+    "D1": mt5.TIMEFRAME_D1,
+    "W1": mt5.TIMEFRAME_W1,
+    "MN1": mt5.TIMEFRAME_MN1
+}
+TIMEFRAME_NAMES = {tf_const: tf_str for tf_str, tf_const in TIMEFRAME_CONSTANTS.items()}
+
+# Length of each timeframe in seconds
+TIMEFRAME_SECONDS = {
+    "M1": 60,
+    "M2": 120,
+    "M3": 180,
+    "M4": 240,
+    "M5": 300,
+    "M6": 360,
+    "M10": 600,
+    "M12": 720,
+    "M15": 900,
+    "M20": 1200,
+    "M30": 1800,
+    "H1": 3600,
+    "H2": 7200,
+    "H3": 10800,
+    "H4": 14400,
+    "H6": 21600,
+    "H8": 28800,
+    "H12": 43200,
+    "D1": 86400,
+    "W1": 604800,
+    "MN1": 2592000  # Approximation for a month (30 days)
+}
+
+# Number of symbol/timeframe downloads requested from MetaTrader 5 at once
+DOWNLOAD_WORKERS = 8
+
+# Completed candles older than this many days are moved out of the candle
+# tables into compressed daily blocks in the candles_cold table, once a day
+COLD_AFTER_DAYS = 30
+
+# Candles fetched per update once a table has been fully updated; only the
+# newest candles can still change
+TAIL_CANDLES = 3
+
+# (time, is_completed) of the newest candle written for each (symbol, timeframe)
+last_written = {}
+
+# Times of the candles stored as completed in each table
+known_completed = {}
+
+# Time of the oldest candle stored as incomplete, other than the newest one,
+# for each (symbol, timeframe) that has one; updates download back to it so
+# it gets corrected
+oldest_incomplete = {}
+
+# Time below which the candles of each (symbol, timeframe) are archived
+cold_watermarks = {}
+
+# (time_msc, wall-clock time it last changed) of each symbol's latest quote
+last_quotes = {}
+
+# Wall-clock time until which each closed symbol is skipped
+closed_until = {}
+
+# time_msc of the symbol's latest quote when each (symbol, timeframe) was last downloaded
+fetched_quotes = {}
+
+# Candle upsert statement of each table
+upsert_sql = {}
+
 def signal_handler(sig, frame):
     """Handle termination signals to gracefully shut down"""
     global running
     logger.info("Received termination signal. Shutting down...")
     running = False
+    shutdown_event.set()
 
 def load_config(config_path):
     """
@@ -59,54 +173,74 @@ def create_db_connection(db_path):
     """
     conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE,
+        # which takes the write lock up front instead of upgrading it mid-transaction
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        
+        # WAL lets readers (API server) run alongside the writer, and
+        # synchronous=NORMAL drops the extra fsync per commit in WAL mode
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")  # Wait up to 30s for a lock instead of failing
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MiB memory map
+        conn.execute("PRAGMA wal_autocheckpoint=1000")  # Checkpoint the WAL every 1000 pages
+        
         logger.info(f"Successfully connected to database at {db_path}")
         return conn
     except sqlite3.Error as e:
         logger.error(f"Error connecting to database: {e}")
         return None
 
-def init_database(conn, symbols, timeframes):
+def init_database(conn, symbols, timeframes, symbol_digits):
     """
     Initialize database with tables for each symbol and timeframe combination.
     
     :param conn: SQLite connection object
     :param symbols: List of symbols
     :param timeframes: List of timeframes
+    :param symbol_digits: Dictionary mapping each symbol to its number of price digits
+    :return: Dictionary mapping each symbol to the digits its stored prices are scaled by,
+             or None if the tables couldn't be initialized
     """
     if conn is None:
-        return
+        return {}
         
     cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        # Symbol digits and the archive of old candles
+        stored_digits = create_store_tables(cursor, symbol_digits)
+        
+        # Create tables for each symbol and timeframe combination
+        converted = False
+        for symbol in symbols:
+            for timeframe in timeframes:
+                # Create a valid table name using the timeframe name (M1, H1, etc.)
+                table_name = f"{symbol}_{timeframe}"
+                
+                # Create table if it doesn't exist
+                if create_candle_table(cursor, table_name, stored_digits[symbol]):
+                    logger.info(f"Converted table {table_name} to the integer price layout")
+                    converted = True
+                
+                # Archived candles are never downloaded and written again
+                cold_watermarks[(symbol, timeframe)] = get_cold_watermark(cursor, symbol, timeframe)
+        
+        cursor.execute("COMMIT")
+        
+        # Give the space freed by converted tables back to the file system
+        if converted:
+            cursor.execute("VACUUM")
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Error initializing database tables: {e}")
+        return None
     
-    # Create tables for each symbol and timeframe combination
-    for symbol in symbols:
-        for timeframe in timeframes:
-            # Create a valid table name using the timeframe name (M1, H1, etc.)
-            table_name = f"{symbol}_{timeframe}"
-            
-            # Create table if it doesn't exist
-            cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS "{table_name}" (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                datetime TEXT UNIQUE,
-                time INTEGER,
-                open REAL,
-                high REAL,
-                low REAL,
-                close REAL,
-                tick_volume INTEGER,
-                spread INTEGER,
-                real_volume INTEGER,
-                is_completed INTEGER DEFAULT 1
-            )
-            ''')
-            
-            # Create index for faster querying
-            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_datetime ON "{table_name}" (datetime)')
-    
-    conn.commit()
     logger.info("Database tables initialized")
+    return stored_digits
 
 def get_timeframe_constant(timeframe_str):
     """
@@ -115,30 +249,7 @@ def get_timeframe_constant(timeframe_str):
     :param timeframe_str: String representation of the timeframe (e.g., "M1", "H1")
     :return: MetaTrader timeframe constant
     """
-    timeframe_dict = {
-        "M1": mt5.TIMEFRAME_M1,
-        "M2": mt5.TIMEFRAME_M2,
-        "M3": mt5.TIMEFRAME_M3,
-        "M4": mt5.TIMEFRAME_M4,
-        "M5": mt5.TIMEFRAME_M5,
-        "M6": mt5.TIMEFRAME_M6,
-        "M10": mt5.TIMEFRAME_M10,
-        "M12": mt5.TIMEFRAME_M12,
-        "M15": mt5.TIMEFRAME_M15,
-        "M20": mt5.TIMEFRAME_M20,
-        "M30": mt5.TIMEFRAME_M30,
-        "H1": mt5.TIMEFRAME_H1,
-        "H2": mt5.TIMEFRAME_H2,
-        "H3": mt5.TIMEFRAME_H3,
-        "H4": mt5.TIMEFRAME_H4,
-        "H6": mt5.TIMEFRAME_H6,
-        "H8": mt5.TIMEFRAME_H8,
-        "H12": mt5.TIMEFRAME_H12,
-        "D1": mt5.TIMEFRAME_D1,
-        "W1": mt5.TIMEFRAME_W1,
-        "MN1": mt5.TIMEFRAME_MN1
-    }
-    return timeframe_dict.get(timeframe_str)
+    return TIMEFRAME_CONSTANTS.get(timeframe_str)
 
 def get_timeframe_name(timeframe):
     """
@@ -147,30 +258,7 @@ def get_timeframe_name(timeframe):
     :param timeframe: MetaTrader timeframe constant
     :return: String representation of the timeframe
     """
-    timeframe_dict = {
-        mt5.TIMEFRAME_M1: "M1",
-        mt5.TIMEFRAME_M2: "M2",
-        mt5.TIMEFRAME_M3: "M3",
-        mt5.TIMEFRAME_M4: "M4",
-        mt5.TIMEFRAME_M5: "M5",
-        mt5.TIMEFRAME_M6: "M6",
-        mt5.TIMEFRAME_M10: "M10",
-        mt5.TIMEFRAME_M12: "M12",
-        mt5.TIMEFRAME_M15: "M15",
-        mt5.TIMEFRAME_M20: "M20",
-        mt5.TIMEFRAME_M30: "M30",
-        mt5.TIMEFRAME_H1: "H1",
-        mt5.TIMEFRAME_H2: "H2",
-        mt5.TIMEFRAME_H3: "H3",
-        mt5.TIMEFRAME_H4: "H4",
-        mt5.TIMEFRAME_H6: "H6",
-        mt5.TIMEFRAME_H8: "H8",
-        mt5.TIMEFRAME_H12: "H12",
-        mt5.TIMEFRAME_D1: "D1",
-        mt5.TIMEFRAME_W1: "W1",
-        mt5.TIMEFRAME_MN1: "MN1"
-    }
-    return timeframe_dict.get(timeframe, f"Unknown_{timeframe}")
+    return TIMEFRAME_NAMES.get(timeframe, f"Unknown_{timeframe}")
 
 def get_timeframe_seconds(timeframe_str):
     """
@@ -179,18 +267,7 @@ def get_timeframe_seconds(timeframe_str):
     :param timeframe_str: String representation of timeframe (M1, H1, etc.)
     :return: Number of seconds
     """
-    if timeframe_str.startswith('M'):
-        return int(timeframe_str[1:]) * 60
-    elif timeframe_str.startswith('H'):
-        return int(timeframe_str[1:]) * 3600
-    elif timeframe_str == 'D1':
-        return 86400
-    elif timeframe_str == 'W1':
-        return 604800
-    elif timeframe_str == 'MN1':
-        return 2592000  # Approximation for a month (30 days)
-    else:
-        return None
+    return TIMEFRAME_SECONDS.get(timeframe_str)
 
 def is_candle_complete(current_time, candle_time, timeframe_str):
     """
@@ -209,118 +286,238 @@ def is_candle_complete(current_time, candle_time, timeframe_str):
     candle_end_time = candle_time + timeframe_seconds
     return current_time >= candle_end_time
 
-def update_database(conn, symbol, timeframe_const, timeframe_str, lookback=99999):
+def fetch_rates(symbol, timeframe_const, timeframe_str, lookback=99999):
     """
-    Update the database with the latest candles, marking the current candle as incomplete.
+    Download the candles of a symbol and timeframe that may have changed since
+    the last update. Runs on the download threads.
     
-    :param conn: SQLite connection object
     :param symbol: Trading symbol
     :param timeframe_const: MetaTrader timeframe constant
     :param timeframe_str: String representation of timeframe (M1, H1, etc.)
-    :param lookback: Number of recent candles to check
-    :return: Number of updated candles
+    :param lookback: Number of recent candles to check on the first update
+    :return: Numpy array with candle data, or None if no data is available
     """
-    if conn is None:
-        return 0
-    
     # Select the symbol in Market Watch
     if not mt5.symbol_select(symbol, True):
         logger.error(f"Failed to select {symbol} in Market Watch")
-        return 0
+        return None
     
-    # Download recent data
-    rates = mt5.copy_rates_from_pos(symbol, timeframe_const, 0, lookback)
+    # Download recent data: the whole lookback on the first update, then only
+    # the tail, reaching back to the oldest candle stored as incomplete, unless
+    # candles were missed since the last update
+    key = (symbol, timeframe_str)
+    state = last_written.get(key)
+    rates = None
+    if state is not None:
+        start = min(state[0], oldest_incomplete.get(key, state[0]))
+        count = TAIL_CANDLES + (state[0] - start) // (get_timeframe_seconds(timeframe_str) or 60)
+        rates = mt5.copy_rates_from_pos(symbol, timeframe_const, 0, count)
+        if rates is not None and len(rates) > 0 and rates[0]['time'] > start:
+            rates = None
+    if rates is None:
+        rates = mt5.copy_rates_from_pos(symbol, timeframe_const, 0, lookback)
     if rates is None or len(rates) == 0:
         logger.warning(f"No data available for {symbol} {timeframe_str}")
-        return 0
+        return None
     
-    # Convert to pandas DataFrame
-    df = pd.DataFrame(rates)
+    return rates
+
+def is_market_closed(symbol, timeframes, now):
+    """
+    Check whether a symbol's market is closed, so its downloads can be skipped.
+    The market counts as closed once the symbol's quotes haven't changed for
+    MARKET_IDLE_SECONDS and its newest candles are all stored as completed.
     
-    # Current UTC time for determining completed candles
-    current_time = int(datetime.now(pytz.UTC).timestamp())
+    :param symbol: Trading symbol
+    :param timeframes: List of timeframe strings updated for the symbol
+    :param now: Current wall-clock time (time.time())
+    :return: True if the symbol should be skipped this cycle, False otherwise
+    """
+    if now < closed_until.get(symbol, 0):
+        return True
+    
+    tick = mt5.symbol_info_tick(symbol)
+    if tick is None:
+        return False
+    
+    quote_time, changed_at = last_quotes.get(symbol, (None, now))
+    if tick.time_msc != quote_time:
+        last_quotes[symbol] = (tick.time_msc, now)
+        if closed_until.pop(symbol, None) is not None:
+            logger.info(f"New quotes for {symbol}, resuming updates")
+        return False
+    
+    if now - changed_at < MARKET_IDLE_SECONDS:
+        return False
+    if not all(last_written.get((symbol, tf_str), (None, False))[1] for tf_str in timeframes):
+        return False
+    
+    if symbol not in closed_until:
+        logger.info(f"No quotes for {symbol} in {MARKET_IDLE_SECONDS}s, market looks closed; "
+                    f"checking again every {MARKET_RECHECK_SECONDS}s")
+    closed_until[symbol] = now + MARKET_RECHECK_SECONDS
+    return True
+
+def has_new_data(symbol, timeframe_str, now):
+    """
+    Check whether the candles of a symbol and timeframe may have changed since
+    they were last downloaded: a new quote arrived after the newest stored
+    candle, the newest candle was stored incomplete and has closed since, or
+    an older candle is still stored incomplete. Uses the quote read by
+    is_market_closed, and records it as downloaded.
     
-    # Convert the time column to datetime format
-    df['datetime'] = pd.to_datetime(df['time'], unit='s')
-    df['datetime_str'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    :param symbol: Trading symbol
+    :param timeframe_str: String representation of timeframe (M1, H1, etc.)
+    :param now: Current wall-clock time (time.time())
+    :return: True if the candles should be downloaded, False otherwise
+    """
+    key = (symbol, timeframe_str)
+    quote_time = last_quotes.get(symbol, (None, now))[0]
+    state = last_written.get(key)
+    if state is None or quote_time is None or key in oldest_incomplete:
+        fetched_quotes[key] = quote_time
+        return True
+    
+    candle_end = state[0] + (get_timeframe_seconds(timeframe_str) or 0)
+    if quote_time != fetched_quotes.get(key):
+        fetched_quotes[key] = quote_time
+        # A late quote within the newest candle, once that candle is stored
+        # as completed, can't start a new candle
+        return not (state[1] and quote_time // 1000 < candle_end)
+    if not state[1] and now >= candle_end:
+        return True
+    return False
+
+def get_upsert_sql(table_name):
+    """
+    Get the statement that writes candles to a table, built once per table so
+    every update passes sqlite3 the same string and reuses its compiled statement.
     
-    # Determine which candles are complete
-    df['is_completed'] = df['time'].apply(
-        lambda x: 1 if is_candle_complete(current_time, x, timeframe_str) else 0
-    )
+    :param table_name: Table name in the form SYMBOL_TIMEFRAME
+    :return: SQL string
+    """
+    sql = upsert_sql.get(table_name)
+    if sql is None:
+        # Insert new candles and update the stored ones that were still
+        # incomplete or whose completion status changed
+        sql = upsert_sql[table_name] = f'''
+        INSERT INTO "{table_name}" (
+            time, open, high, low, close,
+            tick_volume, spread, real_volume, is_completed
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(time) DO UPDATE SET
+            open = excluded.open, high = excluded.high,
+            low = excluded.low, close = excluded.close, tick_volume = excluded.tick_volume,
+            spread = excluded.spread, real_volume = excluded.real_volume,
+            is_completed = excluded.is_completed
+        WHERE "{table_name}".is_completed = 0 OR "{table_name}".is_completed <> excluded.is_completed
+        '''
+    return sql
+
+def write_rates(cursor, symbol, timeframe_str, rates, digits):
+    """
+    Write downloaded candles to the database, marking the current candle as incomplete.
+    Writes inside the caller's transaction; database errors are raised to the caller.
     
-    table_name = f"{symbol}_{timeframe_str}"
-    cursor = conn.cursor()
+    :param cursor: SQLite cursor object, reused for every update
+    :param symbol: Trading symbol
+    :param timeframe_str: String representation of timeframe (M1, H1, etc.)
+    :param rates: Numpy array with candle data from fetch_rates
+    :param digits: Number of price digits; prices are stored as integers scaled by 10**digits
+    :return: Number of updated candles
+    """
+    if cursor is None:
+        return 0
     
-    # Get existing candles
-    existing_candles = {}
-    try:
-        cursor.execute(f'SELECT datetime, is_completed FROM "{table_name}"')
-        for row in cursor.fetchall():
-            existing_candles[row[0]] = row[1]
-    except sqlite3.Error as e:
-        logger.error(f"Error retrieving existing candles: {e}")
+    # Current UTC time for determining completed candles
+    current_time = int(datetime.now(pytz.UTC).timestamp())
+    
+    # Nothing can change once the newest candle was written as completed,
+    # unless an older one is still stored incomplete
+    key = (symbol, timeframe_str)
+    last_time = int(rates[-1]['time'])
+    last_completed = is_candle_complete(current_time, last_time, timeframe_str)
+    if last_written.get(key) == (last_time, True) and key not in oldest_incomplete:
         return 0
     
-    updated_count = 0
+    # Skip the candles that were already archived
+    rates = rates[rates['time'] >= cold_watermarks.get(key, 0)]
+    if len(rates) == 0:
+        return 0
     
-    # Process each candle
-    for _, row in df.iterrows():
-        datetime_str = row['datetime_str']
-        is_completed = row['is_completed']
-        
-        if datetime_str in existing_candles:
-            # Update existing candle if it's not completed or if the completion status changed
-            if existing_candles[datetime_str] == 0 or existing_candles[datetime_str] != is_completed:
-                try:
-                    cursor.execute(f'''
-                    UPDATE "{table_name}" SET 
-                        time = ?, open = ?, high = ?, low = ?, close = ?, 
-                        tick_volume = ?, spread = ?, real_volume = ?, is_completed = ?
-                    WHERE datetime = ?
-                    ''', (
-                        int(row['time']),
-                        float(row['open']),
-                        float(row['high']),
-                        float(row['low']),
-                        float(row['close']),
-                        int(row['tick_volume']),
-                        int(row['spread']) if 'spread' in row and not np.isnan(row['spread']) else 0,
-                        int(row['real_volume']) if 'real_volume' in row and not np.isnan(row['real_volume']) else 0,
-                        int(is_completed),
-                        datetime_str
-                    ))
-                    updated_count += 1
-                except sqlite3.Error as e:
-                    logger.error(f"Error updating row: {e}")
-        else:
-            # Insert new candle
-            try:
-                cursor.execute(f'''
-                INSERT INTO "{table_name}" (
-                    datetime, time, open, high, low, close, 
-                    tick_volume, spread, real_volume, is_completed
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    datetime_str,
-                    int(row['time']),
-                    float(row['open']),
-                    float(row['high']),
-                    float(row['low']),
-                    float(row['close']),
-                    int(row['tick_volume']),
-                    int(row['spread']) if 'spread' in row and not np.isnan(row['spread']) else 0,
-                    int(row['real_volume']) if 'real_volume' in row and not np.isnan(row['real_volume']) else 0,
-                    int(is_completed)
-                ))
-                updated_count += 1
-            except sqlite3.Error as e:
-                logger.error(f"Error inserting row: {e}")
+    times = rates['time'].astype(np.int64)
+    
+    # A candle is complete if the current time is past the end of the candle
+    # period (default to complete if we can't determine the period). Every
+    # candle but the newest is complete as well: a newer candle has started,
+    # whatever the offset between the broker's server time and UTC.
+    timeframe_seconds = get_timeframe_seconds(timeframe_str)
+    if timeframe_seconds is None:
+        is_completed = np.ones(len(rates), dtype=np.int8)
+    else:
+        is_completed = (current_time >= times + timeframe_seconds).astype(np.int8)
+        is_completed[:-1] = 1
     
-    conn.commit()
+    table_name = f"{symbol}_{timeframe_str}"
     
-    if updated_count > 0:
-        logger.info(f"Updated {updated_count} candles for {symbol} {timeframe_str}")
+    # Missing spread and real volume columns or values are stored as 0,
+    # replaced once per column rather than per candle
+    no_values = np.zeros(len(rates), dtype=np.int64)
+    spread = np.nan_to_num(rates['spread']) if 'spread' in rates.dtype.names else no_values
+    real_volume = np.nan_to_num(rates['real_volume']) if 'real_volume' in rates.dtype.names else no_values
+    
+    # Build the parameter tuples straight from the fields of the MT5 structured
+    # array, as plain Python lists (sqlite3 can't bind NumPy integers); prices
+    # become integer counts of the symbol's last digit
+    scale = 10.0 ** digits
+    rows = list(zip(
+        times.tolist(),
+        np.rint(rates['open'] * scale).astype(np.int64).tolist(),
+        np.rint(rates['high'] * scale).astype(np.int64).tolist(),
+        np.rint(rates['low'] * scale).astype(np.int64).tolist(),
+        np.rint(rates['close'] * scale).astype(np.int64).tolist(),
+        rates['tick_volume'].astype(np.int64).tolist(),
+        spread.astype(np.int64).tolist(),
+        real_volume.astype(np.int64).tolist(),
+        is_completed.tolist()
+    ))
+    
+    # Completed candles never change once stored, so skip them. The times of the
+    # stored completed candles are read once per table and then kept up to date.
+    requested_oldest = oldest_incomplete.get(key)
+    completed_times = known_completed.get(table_name)
+    if completed_times is None:
+        cursor.execute(f'SELECT time FROM "{table_name}" WHERE time >= ? AND is_completed = 1', (rows[0][0],))
+        completed_times = known_completed[table_name] = {row[0] for row in cursor}
+        cursor.execute(f'SELECT MIN(time) FROM "{table_name}" WHERE time < ? AND is_completed = 0', (last_time,))
+        stored_oldest = cursor.fetchone()[0]
+        if stored_oldest is not None:
+            oldest_incomplete[key] = stored_oldest
+    rows = [row for row in rows if not (row[8] and row[0] in completed_times)]
+    
+    # Insert new candles and update the stored ones; the caller commits the update cycle
+    cursor.executemany(get_upsert_sql(table_name), rows)
+    updated_count = cursor.rowcount
+    completed_times.update(row[0] for row in rows if row[8])
+    
+    # Only the newest candle of a batch can be incomplete, so stored incomplete
+    # candles from the batch's first candle on have now been corrected
+    if oldest_incomplete.get(key, times[0]) >= times[0]:
+        oldest_incomplete.pop(key, None)
+    elif requested_oldest is not None:
+        # fetch_rates reached back as far as the terminal's history goes, so
+        # the older incomplete candles can't be corrected; a newer candle
+        # exists, so they are closed and are kept as stored
+        cursor.execute(f'UPDATE "{table_name}" SET is_completed = 1 WHERE time < ? AND is_completed = 0',
+                       (int(times[0]),))
+        oldest_incomplete.pop(key)
+        logger.warning("Marked %d candles of %s %s older than the terminal's history as completed",
+                       cursor.rowcount, symbol, timeframe_str)
+    
+    last_written[key] = (last_time, last_completed)
+    
+    if updated_count > 0 and logger.isEnabledFor(logging.INFO):
+        logger.info("Updated %d candles for %s %s", updated_count, symbol, timeframe_str)
     
     return updated_count
 
@@ -401,48 +598,137 @@ def main():
         mt5.shutdown()
         return
     
+    # Cache the price digits of each symbol, used to store its prices as integers
+    symbol_digits = {}
+    for symbol in symbols:
+        info = mt5.symbol_info(symbol) if mt5.symbol_select(symbol, True) else None
+        if info is None:
+            logger.warning(f"Symbol {symbol} not found, skipping")
+            continue
+        symbol_digits[symbol] = info.digits
+    symbols = [symbol for symbol in symbols if symbol in symbol_digits]
+    
     # Initialize database tables
-    init_database(conn, symbols, [tf_str for _, tf_str in timeframes])
+    symbol_digits = init_database(conn, symbols, [tf_str for _, tf_str in timeframes], symbol_digits)
+    if symbol_digits is None:
+        conn.close()
+        mt5.shutdown()
+        return
     
     # Calculate optimal update interval
     update_interval = calculate_update_interval([tf_str for _, tf_str in timeframes])
     logger.info(f"Using update interval of {update_interval} seconds")
     
+    # Length of the shortest candle, to wake up right after each candle closes
+    candle_seconds = min((get_timeframe_seconds(tf_str) or 60 for _, tf_str in timeframes), default=60)
+    
     # Initialize counters for statistics
     update_count = 0
     start_time = time.time()
     
+    timeframe_strs = [tf_str for _, tf_str in timeframes]
+    combinations = [(symbol, tf_const, tf_str) for symbol in symbols for tf_const, tf_str in timeframes]
+    executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+    next_archive_time = 0
+    
+    # One cursor writes every update cycle
+    cursor = conn.cursor()
+    
     try:
         # Main update loop
         while running:
+            # Once a day, move the candles older than COLD_AFTER_DAYS (whole
+            # days) into compressed blocks
+            now = time.time()
+            if now >= next_archive_time:
+                day_start = int(now) - int(now) % SECONDS_PER_DAY
+                cutoff = day_start - COLD_AFTER_DAYS * SECONDS_PER_DAY
+                total_archived = 0
+                for symbol, _, tf_str in combinations:
+                    try:
+                        cursor.execute("BEGIN IMMEDIATE")
+                        archived = archive_cold_candles(cursor, symbol, tf_str, cutoff)
+                        watermark = get_cold_watermark(cursor, symbol, tf_str)
+                        cursor.execute("COMMIT")
+                    except sqlite3.Error as e:
+                        conn.rollback()
+                        logger.error(f"Error archiving candles of {symbol}_{tf_str}: {e}")
+                        continue
+                    
+                    # Stop writing the archived candles, and forget their times
+                    cold_watermarks[(symbol, tf_str)] = watermark
+                    known_completed.pop(f"{symbol}_{tf_str}", None)
+                    total_archived += archived
+                if total_archived:
+                    logger.info(f"Archived {total_archived} candles older than {COLD_AFTER_DAYS} days")
+                next_archive_time = day_start + SECONDS_PER_DAY
+            
             update_start_time = time.time()
             total_updates = 0
             
-            # Process each symbol and timeframe
-            for symbol in symbols:
-                for tf_const, tf_str in timeframes:
-                    updates = update_database(conn, symbol, tf_const, tf_str)
-                    total_updates += updates
+            # Skip the symbols whose market is closed, and the candles that
+            # can't have changed since they were last downloaded: the quotes
+            # polled here are cheap, so MetaTrader 5 only sends candles when
+            # there is something new
+            now = time.time()
+            open_symbols = {symbol for symbol in symbols if not is_market_closed(symbol, timeframe_strs, now)}
+            active = [
+                (symbol, tf_const, tf_str)
+                for symbol, tf_const, tf_str in combinations
+                if symbol in open_symbols and has_new_data(symbol, tf_str, now)
+            ]
+            
+            # Download all symbol/timeframe combinations concurrently; the MT5
+            # calls are I/O bound, while writing stays on this thread so SQLite
+            # has a single writer
+            futures = [
+                executor.submit(fetch_rates, symbol, tf_const, tf_str)
+                for symbol, tf_const, tf_str in active
+            ]
+            
+            # Write the whole cycle in one transaction
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for (symbol, _, tf_str), future in zip(active, futures):
+                    rates = future.result()
+                    if rates is not None:
+                        total_updates += write_rates(cursor, symbol, tf_str, rates, symbol_digits[symbol])
+                cursor.execute("COMMIT")
+            except sqlite3.Error as e:
+                conn.rollback()
+                # Nothing of this cycle was written, so fetch and check everything again
+                last_written.clear()
+                known_completed.clear()
+                oldest_incomplete.clear()
+                fetched_quotes.clear()
+                total_updates = 0
+                logger.error(f"Error writing candles, update cycle rolled back: {e}")
             
             update_count += 1
             elapsed = time.time() - update_start_time
             
             # Log statistics every 10 updates
-            if update_count % 10 == 0:
+            if update_count % 10 == 0 and logger.isEnabledFor(logging.INFO):
                 total_elapsed = time.time() - start_time
-                logger.info(f"Stats: {update_count} updates, {total_elapsed:.1f}s total time, avg {total_elapsed/update_count:.2f}s per cycle")
+                logger.info("Stats: %d updates, %.1fs total time, avg %.2fs per cycle",
+                            update_count, total_elapsed, total_elapsed / update_count)
             
-            # Sleep for the remaining time in the update interval
-            sleep_time = max(0.05, update_interval - elapsed)
-            if total_updates > 0:
-                logger.info(f"Updated {total_updates} candles in {elapsed:.2f}s, sleeping for {sleep_time:.2f}s")
-            time.sleep(0.1)
+            # Sleep for the remaining time in the update interval, but wake up
+            # as soon as the shortest candle closes
+            now = time.time()
+            until_close = candle_seconds - now % candle_seconds + CANDLE_CLOSE_DELAY
+            sleep_time = max(0.05, min(update_interval - elapsed, until_close))
+            if total_updates > 0 and logger.isEnabledFor(logging.INFO):
+                logger.info("Updated %d candles in %.2fs, sleeping for %.2fs", total_updates, elapsed, sleep_time)
+            shutdown_event.wait(sleep_time)
     
     except Exception as e:
         logger.exception(f"Unexpected error: {e}")
     
     finally:
         # Clean up
+        executor.shutdown()
+        
         if conn:
             conn.close()
             logger.info("Database connection closed")